@@ -7,14 +7,20 @@
 from ErrorAnalyser import ErrorAnalyser
 from RunSelection import RunSelection
 from RootDraw import *
-from Utils import print_banner, log_critical, make_runplan_string
+from Utils import print_banner, log_critical, make_runplan_string, make_record_array, add_counts
+from Prefetcher import Prefetcher
+from Preview import refine_in_background
+from Accumulator import calc_phi_coefficients
+from SparseMap import merge_maps
 from collections import OrderedDict
 from argparse import ArgumentParser
+from os.path import getsize
+from time import time
 
 
 class AnalysisCollection:
 
-    def __init__(self, selection):
+    def __init__(self, selection, prefetch=True, n_ahead=1):
         self.Runs = selection.get_selected_runs()
         self.RunPlan = selection.SelectedRunPlan
         self.Trim = selection.RunPlan[self.RunPlan]['trim']
@@ -23,6 +29,12 @@ class AnalysisCollection:
         self.Collection = self.load_collection()
         self.FirstAnalysis = self.Collection.values()[0]
 
+        # prefetching
+        self.Prefetch = prefetch
+        self.NAhead = n_ahead
+        self.FileSizes = OrderedDict((run, getsize(ana.File.GetName())) for run, ana in self.Collection.iteritems())
+        self.ProcessingOrder = sorted(self.Collection, key=lambda run: self.FileSizes[run], reverse=True)
+
         self.SaveDir = make_runplan_string(self.RunPlan)
         self.Draw = RootDraw(self)
 
@@ -37,35 +49,150 @@ class AnalysisCollection:
             log_critical('Empty collection')
         return dic
 
+    def get_values(self, f, prefetch=True):
+        """ Applies f to all analyses, largest files first. If f reads the whole tree (prefetch), the files of the next runs without cached results
+            are read in the background.
+            :return: list of the results in run order """
+        runs = [run for run in self.ProcessingOrder if not self.Collection[run].has_accumulator()] if self.Prefetch and prefetch else []
+        prefetcher = Prefetcher([self.Collection[run].File.GetName() for run in runs], self.NAhead)
+        values, t = {}, time()
+        try:
+            for run in self.ProcessingOrder:
+                if run in runs:
+                    prefetcher.advance(runs.index(run))
+                values[run] = f(self.Collection[run])
+        finally:
+            prefetcher.stop()
+        if runs:
+            log_message('Processed {n} runs ({p} with prefetching) in {t:.1f} s'.format(n=len(values), p=len(runs), t=time() - t))
+        return [values[run] for run in self.Collection]
+
     def get_hit_rates(self):
-        return [col.get_hit_rate(False) for col in self.Collection.itervalues()]
+        return self.get_values(lambda ana: ana.get_hit_rate(False))
 
     def get_buffer_errors(self):
-        return [col.calc_buffer_proportion(False) for col in self.Collection.itervalues()]
+        return self.get_values(lambda ana: ana.calc_buffer_proportion(False))
+
+    def get_summary_rows(self):
+        """ :return: list with the numeric results (see ErrorAnalyser.get_summary) of all runs extended by the run plan settings """
+        rows = self.get_values(lambda ana: ana.get_summary())
+        for dic in rows:
+            dic.update([('plan', self.RunPlan)] + [(name, value if type(value) is int else -1) for name, value in [('trim', self.Trim), ('ctrlreg', self.CTRLREG)]])
+        return rows
+
+    def get_summaries(self):
+        """ :return: record array with the numeric results of all runs """
+        return make_record_array(self.get_summary_rows())
+
+    def get_buffer_corruptions(self):
+        """ :return: hit rates [Hz] and buffer corruption fractions of all runs """
+        summaries = self.get_summaries()
+        return summaries['hit_rate'], summaries['buffer_corruption_fraction']
+
+    def get_column_counts(self, name='buffer_corruption'):
+        """ :return: errors 'name' and valid hits per column for all runs with shape (runs, NRocs, NCols) """
+        return array(self.get_values(lambda ana: ana.get_error_map(name).get_column_counts())), array(self.get_values(lambda ana: ana.get_column_hits()))
+
+    def get_event_size_fits(self):
+        return self.get_values(lambda ana: ana.get_event_size_fit())
+
+    def get_event_rates(self):
+        """ :return: list of the mean number of hits per event (Poisson lambda) and its uncertainty for all runs, taken from the cached counts """
+        return [(fit['lambda'], fit['lambda_err']) for fit in self.get_event_size_fits()]
+
+    def print_event_rates(self):
+        print 'Run  Lambda            chi2/ndf  Tail Excess [%]'
+        for run, fit in zip(self.Collection, self.get_event_size_fits()):
+            print '{r}  {l:6.3f} +- {e:5.3f}  {c:8.2f}  {t:15.4f}'.format(r=str(run).rjust(3), l=fit['lambda'], e=fit['lambda_err'], c=fit['chi2'] / fit['ndf'], t=fit['tail_excess'] * 100)
+
+    def get_error_correlations(self):
+        """ :return: joint event counts and phi coefficients between the error types, merged over all runs """
+        counts = add_counts(*self.get_values(lambda ana: ana.get_error_correlations()[0]))
+        return counts, calc_phi_coefficients(counts, sum(ana.NEntries for ana in self.Collection.itervalues()))
+
+    def get_roc_correlations(self, name='buffer_corruption'):
+        """ :return: joint event counts and phi coefficients of the errors 'name' between all pairs of ROCs, merged over all runs """
+        counts = add_counts(*self.get_values(lambda ana: ana.get_roc_correlations(name)[0]))
+        return counts, calc_phi_coefficients(counts, sum(ana.NEntries for ana in self.Collection.itervalues()))
+
+    def draw_error_correlations(self, show=True):
+        labels = [' '.join(name.split('_')) for name in self.FirstAnalysis.ErrorNames]
+        return self.FirstAnalysis.draw_correlation_matrix(self.get_error_correlations()[1], labels, 'Error Type Correlation', show)
+
+    def draw_roc_correlations(self, name='buffer_corruption', show=True):
+        labels = ['ROC {i}'.format(i=i) for i in xrange(self.FirstAnalysis.NRocs)]
+        return self.FirstAnalysis.draw_correlation_matrix(self.get_roc_correlations(name)[1], labels, 'ROC Correlation of the {n}s'.format(n=' '.join(name.split('_'))), show)
+
+    def get_previews(self, n_chunks=3, background=True):
+        """ Prints a quick overview of the run plan from a few random entry clusters per run and keeps refining it in the background. """
+        previews = self.get_values(lambda ana: ana.get_preview(n_chunks, prnt=False), prefetch=False)
+        self.print_previews()
+        if background:
+            self.refine_previews()
+        return previews
+
+    def print_previews(self):
+        print 'Run  Done [%]  Hit Rate [MHz]  Buffer Corruptions [per mill]'
+        for run, ana in self.Collection.iteritems():
+            if ana.Preview is not None:
+                (rate, rate_err), (value, err) = ana.Preview.get_hit_rate(), ana.Preview.get_error_fraction()
+                print '{r}  {p:8.1f}  {h:6.1f} +- {he:4.1f}  {v:10.4f} +- {e:6.4f}'.format(r=str(run).rjust(3), p=ana.Preview.get_processed_fraction() * 100, h=rate / 1e6,
+                                                                                       he=rate_err / 1e6, v=value * 1000, e=err * 1000)
+
+    def refine_previews(self, n_processes=1):
+        """ Refines the previews of all runs in background worker processes until they converge to the full results, see Preview.refine_in_background. """
+        return refine_in_background({run: ana.Preview for run, ana in self.Collection.iteritems() if ana.Preview is not None}, n_processes)
 
     def draw_buffer_errors(self, show=True):
-        gr = make_tgrapherrors('g_bc', 'Buffer Corruptions', x=[r / 1e6 for r in self.get_hit_rates()], y=[e * 1e3 for e in self.get_buffer_errors()])
+        rates, fractions = self.get_buffer_corruptions()
+        gr = make_tgrapherrors('g_bc', 'Buffer Corruptions', x=(rates / 1e6).tolist(), y=(fractions * 1e6).tolist())
         format_histo(gr, x_tit='Hit Rate [MHz]', y_tit='Buffer Corruptions [per million]', y_off=1.5)
         self.Draw.draw_histo(gr, show=show, draw_opt='alp', lm=.13)
         return gr
 
+    def draw_time_evolutions(self, name='buffer_corruption', roc=None, bin_width=5e3, show=True):
+        """ Draws the time evolution of all runs side by side, the values are derived from the cached per-run cumulative sums. """
+        evolutions = self.get_values(lambda ana: ana.get_time_evolution(name, roc, bin_width))
+        title = ' '.join(word.title() for word in name.split('_'))
+        mg = make_tmultigraph('mg_te', 'Time Evolution of the {n}s'.format(n=title))
+        leg = make_legend(x1=.75, nentries=len(self.Collection))
+        for run, (edges, fractions, errors) in zip(self.Collection, evolutions):
+            gr = make_tgrapherrors('g_te{r}'.format(r=run), 'Run {r}'.format(r=run), x=((edges[1:] + edges[:-1]) / 2e6).tolist(), y=(fractions * 1000).tolist())
+            for i, err in enumerate(errors):
+                gr.SetPointError(i, 0, err * 1000)
+            format_histo(gr, color=self.Draw.get_color(), markersize=.5)
+            mg.Add(gr, 'p')
+            leg.AddEntry(gr, 'Run {r}'.format(r=run), 'p')
+        format_histo(mg, x_tit='Event Number [1e6]', y_tit='{n} [per mill]'.format(n=title), y_off=1.5, draw_first=True)
+        self.Draw.draw_histo(mg, show=show, draw_opt='a', lm=.13, l=leg)
+        self.Draw.reset_colors()
+        return mg
+
+    def get_occupancy_map(self):
+        return add_counts(*self.get_values(lambda ana: ana.get_occupancy_map()))
+
+    def get_error_map(self, name='buffer_corruption'):
+        """ :return: SparseMap with the errors 'name' of all runs """
+        return merge_maps(self.get_values(lambda ana: ana.get_error_map(name)))
+
     def draw_module_occupancy(self, show=True):
-        histos = [col.draw_module_occupancy(show=False) for col in self.Collection.itervalues()]
-        hist = histos.pop(0)
-        for h in histos:
-            hist.Add(h)
+        hist = self.FirstAnalysis.draw_map(self.get_occupancy_map(), show=False)
         format_histo(hist, title='Accumulated Module Occupancy', stats=0)
         self.Draw.draw_histo(hist, draw_opt='colz', lm=.055, rm=0.105, show=show, x=2, y=.6, f=self.FirstAnalysis.draw_module_grid())
 
     def draw_buffer_map(self, show=True, rel=False, consecutive=False):
-        histos = [col.draw_buffer_map(show=False, rel=rel) for col in self.Collection.itervalues()]
-        hist = histos.pop(0)
-        for i, h in enumerate(histos, 2):
-            hist.Add(h)
-            if consecutive:
+        ana = self.FirstAnalysis
+        if consecutive:
+            maps, column_hits = self.get_values(lambda a: a.get_error_map('buffer_corruption')), self.get_values(lambda a: a.get_column_hits())
+            error_map, good_cols = maps[0], column_hits[0]
+            for i, (m, hits) in enumerate(zip(maps[1:], column_hits[1:]), 2):
+                error_map, good_cols = error_map + m, add_counts(good_cols, hits)
+                hist = ana.draw_map(ana.calc_column_map(error_map.get_column_counts(), good_cols if rel else None), show=False)
                 format_histo(hist, title='Accumulated Buffer Errors {i}'.format(i=i), stats=0, draw_first=True)
                 self.Draw.save_histo(hist, 'AccumulatedBufferErrors{i}'.format(i=str(i).zfill(2)), draw_opt='colz', lm=.055, rm=0.105, show=False,
-                                     x_fac=2, y_fac=.6, f=self.FirstAnalysis.draw_module_grid())
+                                     x_fac=2, y_fac=.6, f=ana.draw_module_grid())
+        bad_cols = self.get_error_map('buffer_corruption').get_column_counts()
+        hist = ana.draw_map(ana.calc_column_map(bad_cols, add_counts(*self.get_values(lambda a: a.get_column_hits())) if rel else None), show=False)
         format_histo(hist, title='Accumulated Buffer Errors', stats=0)
         self.Draw.draw_histo(hist, draw_opt='colz', lm=.055, rm=0.105, show=show, x=2, y=.6, f=self.FirstAnalysis.draw_module_grid())
 
@@ -76,6 +203,7 @@ if __name__ == '__main__':
 
     parser = ArgumentParser(prog='ErrorAnalysisCollection')
     parser.add_argument('plan', nargs='?', help='run plan', default=2)
+    parser.add_argument('-np', '--noprefetch', action='store_true', help='do not read the files of the next runs in the background')
     args = parser.parse_args()
 
     print_banner('STARTING ERROR ANALYSER COLLECTION')
@@ -83,4 +211,4 @@ if __name__ == '__main__':
     # start command line
     sel = RunSelection()
     sel.select_runs_from_runplan(args.plan)
-    z = AnalysisCollection(sel)
+    z = AnalysisCollection(sel, prefetch=not args.noprefetch)
@@ -4,17 +4,20 @@
 # created on February 28th 2017 by M. Reichmann (remichae@phys.ethz.ch)
 # --------------------------------------------------------
 
-from ROOT import TFile, TH2F, TH2I, TCutG, TH1I, TF1, TProfile
+from ROOT import TFile, TH2F, TH2I, TCutG, TH1I, TH1F, TF1
 from argparse import ArgumentParser
 from sys import path
 from os.path import join as joinpath
-from os.path import dirname, realpath
+from os.path import dirname, realpath, isfile
 path.insert(1, joinpath(dirname(realpath(__file__)), 'src'))
 from RootDraw import *
-from Utils import print_banner, capitalise
+from Utils import print_banner, get_tree_values, get_count_dtype
 from glob import glob
 from Pickler import Pickler
-from numpy import ceil, zeros
+from Preview import Preview
+from Accumulator import RunAccumulator
+from collections import OrderedDict
+from numpy import sqrt, errstate
 
 
 class ErrorAnalyser:
@@ -36,27 +39,104 @@ class ErrorAnalyser:
 
         self.NEntries = self.Tree.GetEntries()
         self.Values = {}
+        self.ErrorNames = ['buffer_corruption', 'invalid_address', 'invalid_pulse_height']
+        self.HitVars = OrderedDict([('event', 'Entry$'), ('plane', 'plane'), ('col', 'col'), ('row', 'row')] + [(name, name) for name in self.ErrorNames])
+        self.HitTypes = dict([('event', get_count_dtype(self.NEntries)), ('plane', 'i1'), ('col', 'i2'), ('row', 'i2')] + [(name, 'i2') for name in self.ErrorNames])
+        self.Preview = None
+        self.Accumulator = None
 
         self.Bins2D = [self.NCols, - .5, self.NCols - .5, self.NRows, - .5, self.NRows - .5]
         self.ModBins2D = [self.NCols * 8, - .5, self.NCols * 8 - .5, self.NRows * 2, - .5, self.NRows * 2 - .5]
-        self.EventBins = [int(self.NEntries / 5e3), 0, self.NEntries]
 
         self.Pickler = Pickler(self)
         self.Drawer = RootDraw(self)
 
+    def init_tree_cache(self, n, tree=None, max_size=100 * 1024 * 1024):
+        """ Reads the baskets of all branches in large vectored reads instead of one request per basket. The cache is sized for the compressed
+            baskets of n entries (at most max_size), so it only takes the memory of a single read. """
+        tree = self.Tree if tree is None else tree
+        tree.SetCacheSize(int(min(max_size, 1.1 * tree.GetZipBytes() * n / max(tree.GetEntries(), 1))) + 1024 * 1024)
+        tree.AddBranchToCache('*', True)
+        tree.StopCacheLearningPhase()
+
+    def clear_tree_cache(self, tree=None):
+        (self.Tree if tree is None else tree).SetCacheSize(0)
+
     def get_file_name(self, run):
         for file_name in glob(joinpath(self.DataDir, '*')):
             if str(run).zfill(3) in file_name:
                 return file_name
         raise IOError('Could not find run {r} in {d}'.format(r=run, d=self.DataDir))
 
-    def get_valid_hits(self):
-        self.Pickler.set_path('ValidHits')
+    def get_clusters(self, min_size=1e5):
+        """ :return: list of [first entry, number of entries] chunks which are aligned to the clusters of the tree """
+        chunks, first = [], 0
+        it = self.Tree.GetClusterIterator(0)
+        start = it.Next()
+        while start < self.NEntries:
+            end = min(it.GetNextEntry(), self.NEntries)
+            if end <= start:
+                break
+            if end - first >= min_size or end == self.NEntries:
+                chunks.append([first, end - first])
+                first = end
+            start = it.Next()
+        if first < self.NEntries:
+            chunks.append([first, self.NEntries - first])
+        return chunks
+
+    def read_hits(self, first=0, n=None, tree=None):
+        """ :return: dict with compact numpy arrays (see HitTypes) of all hit variables (see HitVars) for the events [first, first + n) of the tree
+                     (default: the tree of the analysis) """
+        n = self.NEntries - first if n is None else n
+        tree = self.Tree if tree is None else tree
+        tree.SetEstimate(max(tree.Draw('plane', '', 'goff', n, first), 1))
+        n_hits = tree.Draw(':'.join(self.HitVars.values()), '', 'goff para', n, first)
+        return OrderedDict((name, get_tree_values(tree, i, n_hits, self.HitTypes[name])) for i, name in enumerate(self.HitVars))
+
+    def get_preview(self, n_chunks=5, prnt=True):
+        """ Estimates the error rates from a random subset of the entry clusters. Repeated calls refine the same estimate. """
+        if self.Preview is None:
+            self.Preview = Preview(self)
+        self.Preview.refine(n_chunks)
+        if prnt:
+            self.Preview.print_status()
+        return self.Preview
+
+    def get_accumulator(self):
+        """ :return: RunAccumulator with all per-run counts, filled in a single pass over the tree """
+        self.Pickler.set_path('Scan', name='Accumulator', suf=RunAccumulator.Version)
 
         def func():
-            log_message('Getting valid hits for run {r} ...'.format(r=self.RunNumber))
-            return int(self.Tree.Draw('plane', 'buffer_corruption<1', 'goff'))
-        return self.Pickler.run(func)
+            log_message('Scanning run {r} ...'.format(r=self.RunNumber))
+            acc = RunAccumulator(self.NEntries, self.ErrorNames, self.NRocs)
+            chunks = self.get_clusters()
+            self.init_tree_cache(max(n for first, n in chunks))
+            try:
+                for first, n in chunks:
+                    acc.fill(self.read_hits(first, n))
+            finally:
+                self.clear_tree_cache()
+            acc.finish()
+            self.save_scan_summary(acc)
+            return acc
+        if self.Accumulator is None:
+            self.Accumulator = self.Pickler.run(func)
+        return self.Accumulator
+
+    def save_scan_summary(self, acc):
+        """ Saves the per-run totals of the scan (see RunAccumulator.get_scan_summary) in a small extra pickle, e.g. for PlanComparison. """
+        self.Pickler.set_path('Scan', name='Summary', suf=RunAccumulator.Version)
+        self.Pickler.run(None, value=acc.get_scan_summary())
+
+    def has_accumulator(self):
+        """ :return: whether the results of the common scan are already in memory or pickled, i.e. the tree does not have to be read """
+        self.Pickler.set_path('Scan', name='Accumulator', suf=RunAccumulator.Version)
+        return self.Accumulator is not None or isfile(self.Pickler.get_path())
+
+    def get_valid_hits(self):
+        """ :return: number of hits without buffer corruption, taken from the common scan """
+        return int(self.get_accumulator().get_total('valid_hits'))
 
     def get_valid_events(self):
         self.Pickler.set_path('ValidEvents')
@@ -80,13 +160,8 @@ class ErrorAnalyser:
         return rate if not string else r_string
 
     def get_pixel_error(self, name):
-        self.Pickler.set_path('PixelErrors', name=capitalise(name))
-
-        def func():
-            log_message('Getting {n}s for run {r} ...'.format(r=self.RunNumber, n=' '.join(name.split('_'))))
-            n = self.Tree.Draw(name, '{n} > 0'.format(n=name), 'goff')
-            return sum(self.Tree.GetV1()[i] for i in xrange(n))
-        return self.Pickler.run(func)
+        """ :return: number of errors 'name', taken from the common scan """
+        return int(self.get_accumulator().get_total(name))
 
     def get_buffer_errors(self):
         return self.get_pixel_error('buffer_corruption')
@@ -103,83 +178,138 @@ class ErrorAnalyser:
             print '{0:6.4f}% Buffer Corruptions'.format(n)
         return n
 
-    def draw_time_bes(self, show=True):
-        h = TProfile('h_tbe', 'Time Evolution of the Buffer Corruptions', *self.EventBins)
-        self.Tree.Draw('buffer_corruption*1000:Entry$>>h_tbe', '', 'goff')
-        format_histo(h, x_tit='Event Number', y_tit='Buffer Corruption [per mill]', y_off=2., stats=0)
+    def get_summary(self):
+        """ :return: OrderedDict with all numeric results of the run, computed from the cached counts without drawing anything """
+        acc = self.get_accumulator()
+        valid_hits = float(acc.get_total('valid_hits'))
+        fit = acc.get_event_size_fit()
+        dic = OrderedDict([('run', self.RunNumber), ('voltage', int(self.Voltage)), ('current', int(self.Current)), ('n_entries', self.NEntries), ('hits', acc.get_total('hits')),
+                           ('valid_hits', valid_hits), ('hit_rate', valid_hits / (2.5e-8 * self.NEntries))])
+        for name in self.ErrorNames:
+            dic[name] = acc.get_total(name)
+            dic['{n}_fraction'.format(n=name)] = acc.get_total(name) / valid_hits if valid_hits else 0.
+        dic.update([('lambda', fit['lambda']), ('lambda_err', fit['lambda_err']), ('chi2_ndf', fit['chi2'] / fit['ndf']), ('tail_excess', fit['tail_excess'])])
+        return dic
+
+    def get_time_evolution(self, name='buffer_corruption', roc=None, bin_width=5e3):
+        """ :return: bin edges [event number], fraction of 'name' per valid hit and its uncertainty for bins of bin_width events. The counts are stored in
+                     blocks of 1000 events (see RunAccumulator), so bin_width is rounded to a multiple of 1000 events (at least 1000) and the
+                     last bin may be shorter. """
+        edges, values, hits = self.get_accumulator().get_time_evolution(name, roc, bin_width)
+        with errstate(divide='ignore', invalid='ignore'):
+            fractions = values / hits
+            errors = sqrt(values) / hits
+        fractions[hits == 0], errors[hits == 0] = 0, 0
+        return edges, fractions, errors
+
+    def draw_time_evolution(self, name='buffer_corruption', roc=None, bin_width=5e3, show=True):
+        """ Draws the fraction of 'name' per valid hit for bins of bin_width events, rounded to a multiple of 1000 events (see get_time_evolution). """
+        edges, fractions, errors = self.get_time_evolution(name, roc, bin_width)
+        title = ' '.join(word.title() for word in name.split('_'))
+        h = TH1F('h_te', 'Time Evolution of the {n}s{r}'.format(n=title, r='' if roc is None else ' of ROC {r}'.format(r=roc)), len(edges) - 1, array(edges, 'd'))
+        for i, (value, err) in enumerate(zip(fractions, errors), 1):
+            h.SetBinContent(i, value * 1000)
+            h.SetBinError(i, err * 1000)
+        format_histo(h, x_tit='Event Number', y_tit='{n} [per mill]'.format(n=title), y_off=2., stats=0)
         self.Drawer.draw_histo(h, show=show, lm=.15, rm=.1)
+        return h
+
+    def draw_time_bes(self, show=True, bin_width=5e3, roc=None):
+        return self.draw_time_evolution('buffer_corruption', roc, bin_width, show)
+
+    def get_event_size_fit(self):
+        """ :return: dict with the Poisson mean of the number of hits per event and the goodness of fit (see RunAccumulator.get_event_size_fit) """
+        return self.get_accumulator().get_event_size_fit()
 
     def draw_event_size(self, fit=True, show=True):
+        sizes = self.get_accumulator().EventSizes
         h = TH1I('h_es', 'Event Size', 100, 0, 100)
-        self.Tree.Draw('@plane.size()>>h_es', '', 'goff')
+        for i, n in enumerate(sizes[:100], 1):
+            h.SetBinContent(i, float(n))
+        h.SetBinContent(101, float(sizes[100:].sum()))
+        h.SetEntries(float(sizes.sum()))
         f = None
         if fit:
-            set_root_output(False)
+            fit_result = self.get_event_size_fit()
             set_statbox(only_fit=True, entries=1.5, w=.2)
             f = TF1('fit', '[0]*TMath::Poisson(x, [1])', 0, 100)
-            f.SetParameters(1e7, 5)
+            f.SetParameters(float(sizes.sum()), fit_result['lambda'])
             f.SetParNames('Constant', 'Event Rate #lambda')
+            f.SetNpx(1000)
             h.SetName('Fit Result')
-            h.Fit(f, 'q')
+            h.GetListOfFunctions().Add(f)
         x_range = [h.FindFirstBinAbove(0) - 3, h.FindLastBinAbove(0) + 3]
         format_histo(h, x_tit='Number of Hits per Event', y_tit='Number of Entries', y_off=1.6, x_range=x_range)
         self.Drawer.draw_histo(h, show=show, lm=.14)
         return h if not fit else f.GetParameter(1)
 
+    def get_error_correlations(self):
+        """ :return: number of events with both error types (single counts on the diagonal) and the phi coefficients """
+        return self.get_accumulator().get_error_correlations()
+
+    def get_roc_correlations(self, name='buffer_corruption'):
+        """ :return: number of events with errors 'name' on both ROCs (single counts on the diagonal) and the phi coefficients """
+        return self.get_accumulator().get_roc_correlations(name)
+
+    def draw_correlation_matrix(self, phi, labels, title='Error Correlation', show=True):
+        h = TH2F('h_cor', title, len(labels), -.5, len(labels) - .5, len(labels), -.5, len(labels) - .5)
+        for i in xrange(len(labels)):
+            h.GetXaxis().SetBinLabel(i + 1, labels[i])
+            h.GetYaxis().SetBinLabel(i + 1, labels[i])
+            for j in xrange(len(labels)):
+                h.SetBinContent(i + 1, j + 1, phi[i][j])
+        format_histo(h, z_tit='Correlation Coefficient', z_off=1.4, stats=0, z_range=[-1, 1])
+        self.Drawer.draw_histo(h, draw_opt='colz', lm=.17, bm=.17, rm=.17, show=show)
+        return h
+
+    def draw_error_correlations(self, show=True):
+        labels = [' '.join(name.split('_')) for name in self.ErrorNames]
+        return self.draw_correlation_matrix(self.get_error_correlations()[1], labels, 'Error Type Correlation', show)
+
+    def draw_roc_correlations(self, name='buffer_corruption', show=True):
+        labels = ['ROC {i}'.format(i=i) for i in xrange(self.NRocs)]
+        return self.draw_correlation_matrix(self.get_roc_correlations(name)[1], labels, 'ROC Correlation of the {n}s'.format(n=' '.join(name.split('_'))), show)
+
     def draw_occupancy(self, roc=0, show=True):
         h = TH2I('h_oc', 'Occupancy ROC {n}'.format(n=roc), *self.Bins2D)
         self.Tree.Draw('row:col >> h_oc', '', 'goff')
         format_histo(h, x_tit='col', y_tit='row', z_tit='Number of Entries', y_off=1.3, z_off=1.6, stats=0)
         self.Drawer.draw_histo(h, draw_opt='colz', lm=.13, rm=0.17, show=show)
 
-    def draw_module_occupancy(self, show=True):
-        self.Pickler.set_path('Histos', name='ModOccupancy')
+    def get_occupancy_map(self):
+        """ :return: hits per pixel with shape (NRocs, NCols, NRows) """
+        return self.get_accumulator().Occupancy
 
-        def func():
-            hits_per_event = self.get_valid_hits() / float(self.get_valid_events())
-            data = [zeros((self.NCols, self.NRows)) for _ in xrange(self.NRocs)]
-            n_events = int(1e7 / hits_per_event)
-            for i in xrange(int(ceil(self.get_valid_hits() / 1e7))):
-                # print i
-                self.Tree.SetEstimate(self.Tree.Draw('plane', 'row!=80', 'goff', n_events, i * n_events))
-                n = self.Tree.Draw('col:row:plane', 'row!=80', 'goff', n_events, i * n_events)
-                for j in xrange(n):
-                    data[int(self.Tree.GetV3()[j])][int(self.Tree.GetV1()[j])][int(self.Tree.GetV2()[j])] += 1
-            return self.draw_map(data, show=False)
-        h = self.Pickler.run(func)
+    def get_error_map(self, name='buffer_corruption'):
+        """ :return: SparseMap with the number of hits with error 'name' per pixel """
+        return self.get_accumulator().ErrorMaps[name]
+
+    def get_column_hits(self):
+        """ :return: valid hits per column with shape (NRocs, NCols) """
+        return self.get_accumulator().get_column_hits()
+
+    def calc_column_map(self, bad_cols, good_cols=None):
+        """ :return: map with shape (NRocs, NCols, NRows) where every pixel holds the errors of its column, in per mill of the valid hits of the
+                     column (good_cols) if given """
+        data = bad_cols
+        if good_cols is not None:
+            with errstate(divide='ignore', invalid='ignore'):
+                data = bad_cols / good_cols.astype('f8') * 1000.
+            data[good_cols == 0] = 0
+        return data.reshape(self.NRocs, self.NCols, 1).repeat(self.NRows, axis=2)
+
+    def draw_module_occupancy(self, show=True):
+        h = self.draw_map(self.get_occupancy_map(), show=False)
         self.Drawer.draw_histo(h, draw_opt='colz', lm=.055, rm=0.105, show=show, x=2, y=.6, f=self.draw_module_grid)
         return h
 
-    def draw_buffer_map(self, rel=False, show=True):
-        self.Pickler.set_path('Histos', name='BufErrors{m}'.format(m='Rel' if rel else 'Abs'))
+    def get_buffer_map(self, rel=False):
+        """ :return: buffer corruptions of the column of every pixel with shape (NRocs, NCols, NRows), in per mill of the valid column hits if rel """
+        bad_cols = self.get_error_map('buffer_corruption').get_column_counts()
+        return self.calc_column_map(bad_cols, self.get_column_hits() if rel else None)
 
-        def func():
-            log_message('Drawing buffer map for run {r}'.format(r=self.RunNumber))
-            good_data = [zeros(self.NCols) for _ in xrange(self.NRocs)]
-            if rel:
-                h1 = self.draw_module_occupancy(show=False)
-                for col in xrange(h1.GetNbinsX()):
-                    for row in xrange(h1.GetNbinsY()):
-                        # r = row if row < self.NRows else 2 * self.NRows - row - 1
-                        c = col % self.NCols if row < self.NRows else (8 * self.NCols - 1 - col) % self.NCols
-                        roc = col / self.NCols if row < self.NRows else 15 - col / self.NCols
-                        pl = (roc - 12) % 16
-                        good_data[pl][c] += h1.GetBinContent(col + 1, row + 1)
-            bad_data = [zeros(self.NCols) for _ in xrange(self.NRocs)]
-            self.Tree.SetEstimate(self.Tree.Draw('plane', 'buffer_corruption', 'goff'))
-            n = self.Tree.Draw('col:row:plane', 'buffer_corruption', 'goff')
-            for i in xrange(n):
-                try:
-                    bad_data[int(self.Tree.GetV3()[i])][int(self.Tree.GetV1()[i])] += 1
-                except IndexError as err:
-                    log_warning('Column out of range: {e}'.format(e=err))
-            data = [zeros((self.NCols, self.NRows)) for _ in xrange(self.NRocs)]
-            for pl in xrange(self.NRocs):
-                for col in xrange(self.NCols):
-                    for row in xrange(self.NRows):
-                        data[pl][col][row] = bad_data[pl][col] / (float(good_data[pl][col]) + bad_data[pl][col]) * 1000 if rel else bad_data[pl][col]
-            return self.draw_map(data, False)
-        h = self.Pickler.run(func)
+    def draw_buffer_map(self, rel=False, show=True):
+        h = self.draw_map(self.get_buffer_map(rel), False)
         format_histo(h, name='Buffer Corruptions', z_tit='Number of Errors' if not rel else 'Buffer Errors [per mill]', stats=0)
         self.Drawer.draw_histo(h, draw_opt='colz', lm=.055, rm=0.105, show=show, x=2, y=.6, f=self.draw_module_grid)
         return h
@@ -194,7 +324,7 @@ class ErrorAnalyser:
                     # Reverse order of the upper ROC row:
                     y = iy if (roc < 8) else (2 * self.NRows - iy - 1)
                     x = (ix + x_off) if (roc < 8) else (8 * self.NCols - 1 - x_off - ix)
-                    h.SetBinContent(x + 1, y + 1, row)
+                    h.SetBinContent(x + 1, y + 1, float(row))
         format_histo(h, x_tit='col', y_tit='row', z_tit='Number of Entries', y_off=.45, z_off=.5, stats=0, lab_size=.06, tit_size=.06)
         self.Drawer.draw_histo(h, draw_opt='colz', lm=.055, rm=0.105, show=show, x=2, y=.6, f=self.draw_module_grid)
         return h
@@ -6,9 +6,13 @@
 
 from collections import OrderedDict
 from AnalysisCollection import AnalysisCollection
-from Utils import log_critical, print_banner
+from Utils import log_critical, print_banner, make_record_array
 from argparse import ArgumentParser
 from json import loads
+from os import makedirs
+from os.path import dirname, exists
+from numpy import concatenate, savez_compressed
+from csv import writer
 from RootDraw import *
 from RunSelection import RunSelection
 
@@ -35,6 +39,29 @@ class PlanCollection(object):
             log_critical('Empty collection')
         return dic
 
+    def get_summaries(self):
+        """ :return: record array with the numeric results of all runs of all run plans """
+        return make_record_array([row for col in self.Collection.itervalues() for row in col.get_summary_rows()])
+
+    def export(self, file_name=None):
+        """ Saves the results of all run plans in a single columnar file: '.npz' with the summary columns and the per-column counts of
+            buffer corruptions and valid hits, or '.csv' with the summary only. """
+        file_name = join(self.Draw.ResultsDir, 'results.npz') if file_name is None else file_name
+        if dirname(file_name) and not exists(dirname(file_name)):
+            makedirs(dirname(file_name))
+        summaries = self.get_summaries()
+        if file_name.endswith('.csv'):
+            f = open(file_name, 'w')
+            csv_writer = writer(f)
+            csv_writer.writerow(summaries.dtype.names)
+            csv_writer.writerows(summaries.tolist())
+            f.close()
+        else:
+            bad, good = zip(*[col.get_column_counts() for col in self.Collection.itervalues()])
+            savez_compressed(file_name, buffer_corruption_columns=concatenate(bad), valid_hit_columns=concatenate(good), **{name: summaries[name] for name in summaries.dtype.names})
+        log_message('Exported the results of {n} runs to {f}'.format(n=summaries.size, f=file_name))
+        return file_name
+
     def draw_buffer_corruptions(self, show=True):
         mg = make_tmultigraph('mg_be', 'Buffer Corruptions')
         leg = self.Draw.make_legend(nentries=len(self.Collection), x1=.15, x2=.5)
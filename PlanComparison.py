@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# --------------------------------------------------------
+#       Class to compare the error rates of two run plans or run sets
+# created on October 19th 2026
+# --------------------------------------------------------
+
+from Base import Base
+from RunSelection import RunSelection
+from Pickler import Pickler
+from Accumulator import RunAccumulator
+from Utils import print_banner, log_warning, log_critical, make_runplan_string
+from argparse import ArgumentParser
+from json import loads
+from math import erfc
+from pickle import UnpicklingError
+from numpy import array, argsort, searchsorted, sqrt, errstate, vectorize, clip, zeros, arange, tensordot, where
+
+
+class PlanComparison(Base):
+    """ Compares the error fractions per ROC or per column of two run plans (or lists of runs) at matched hit rates. Only the cached per-run
+        results are read, no ROOT file is opened. The fractions (errors per valid hit) of the second set are linearly interpolated to the hit rates
+        of the runs of the first set (inside its range) and the differences are combined with inverse variance weights. The uncertainty of the mean
+        difference includes the correlation of the points which are interpolated from the same runs of the second set. Cells without hits are ignored.
+        Only the small per-run scan summaries are loaded (see RunAccumulator.get_scan_summary). """
+
+    def __init__(self, name='buffer_corruption'):
+
+        Base.__init__(self)
+        self.ProgramDir = self.Dir
+        self.Selection = RunSelection()
+        self.Pickler = Pickler(self)
+        self.Name = name
+
+        self.Summaries = {}
+
+    def get_runs(self, plan):
+        """ :return: list of runs of the run plan, or the plan itself if it is already a list of runs """
+        if type(plan) in [list, tuple]:
+            return list(plan)
+        plan = make_runplan_string(plan)
+        if plan not in self.Selection.RunPlan:
+            log_critical('Run plan {p} does not exist!'.format(p=plan))
+        return [int(run) for run in self.Selection.Catalogue.get_column('run', self.Selection.RunPlan[plan]['runs'])]
+
+    def load_accumulator(self, run):
+        """ :return: the cached accumulator of the run, the run is only scanned (and cached by ErrorAnalyser) if there is none yet """
+        self.Pickler.set_path('Scan', name='Accumulator', run=str(run).zfill(3), suf=RunAccumulator.Version)
+        try:
+            return self.Pickler.load(self.Pickler.get_path())
+        except (IOError, EOFError, UnpicklingError):
+            log_warning('No cached results for run {r}, scanning the run ...'.format(r=run))
+            from ErrorAnalyser import ErrorAnalyser
+            return ErrorAnalyser(run).get_accumulator()
+
+    def load_scan_summary(self, run):
+        """ :return: the small cached totals of the run (see RunAccumulator.get_scan_summary), they are created from the accumulator if missing """
+        self.Pickler.set_path('Scan', name='Summary', run=str(run).zfill(3), suf=RunAccumulator.Version)
+        try:
+            return self.Pickler.load(self.Pickler.get_path())
+        except (IOError, EOFError, UnpicklingError):
+            summary = self.load_accumulator(run).get_scan_summary()
+            self.Pickler.set_path('Scan', name='Summary', run=str(run).zfill(3), suf=RunAccumulator.Version)
+            return self.Pickler.run(None, value=summary)
+
+    def get_summary(self, run):
+        """ :return: hit rate, errors and valid hits per ROC and errors and valid hits per column of the run """
+        if run not in self.Summaries:
+            s = self.load_scan_summary(run)
+            self.Summaries[run] = (s['hit_rate'], s['roc_errors'][self.Name], s['roc_valid_hits'], s['column_errors'][self.Name], s['column_valid_hits'])
+        return self.Summaries[run]
+
+    def get_fractions(self, runs, level='roc'):
+        """ :return: hit rates, error fractions, their variances and whether the cells have hits for the runs sorted by hit rate,
+                     the fractions have shape (runs, NRocs[, NCols]) """
+        summaries = [self.get_summary(run) for run in runs]
+        rates = array([s[0] for s in summaries])
+        i = 1 if level == 'roc' else 3
+        errors, hits = array([s[i] for s in summaries], 'f8'), array([s[i + 1] for s in summaries], 'f8')
+        good = hits > 0
+        with errstate(divide='ignore', invalid='ignore'):
+            fractions = errors / hits
+            variances = (errors + 1) / hits ** 2  # Poisson errors, one count added for cells without errors
+        fractions[~good], variances[~good] = 0, 0
+        order = argsort(rates)
+        return rates[order], fractions[order], variances[order], good[order]
+
+    @staticmethod
+    def get_interpolation_matrix(x, xp):
+        """ :return: matrix with shape (x.size, xp.size) which linearly interpolates values at the points xp to the points x (all inside the range of xp) """
+        i = clip(searchsorted(xp, x), 1, xp.size - 1)
+        w = (x - xp[i - 1]) / (xp[i] - xp[i - 1])
+        matrix = zeros((x.size, xp.size))
+        matrix[arange(x.size), i - 1] = 1 - w
+        matrix[arange(x.size), i] += w
+        return matrix
+
+    def compare(self, plan_a, plan_b, level='roc'):
+        """ Compares the error fractions of plan_a to those of plan_b per ROC (level='roc') or per column (level='column').
+            :return: dict with the matched hit rates, the differences a - b and their significance at every rate (0 for cells without hits), and the
+                     weighted mean difference, its uncertainty, the significance and the two-sided p-value per ROC/column """
+        rates_a, fractions_a, var_a, good_a = self.get_fractions(self.get_runs(plan_a), level)
+        rates_b, fractions_b, var_b, good_b = self.get_fractions(self.get_runs(plan_b), level)
+        if rates_b.size < 2:
+            log_critical('Need at least two runs in the second set to interpolate!')
+        matched = (rates_a >= rates_b[0]) & (rates_a <= rates_b[-1])
+        if not matched.any():
+            log_critical('The hit rates of the two run sets do not overlap!')
+        matrix = self.get_interpolation_matrix(rates_a[matched], rates_b)
+        fractions_a, var_a = fractions_a[matched], var_a[matched]
+        good = good_a[matched] & (tensordot(matrix, ~good_b, 1) == 0)  # no weight on runs of plan_b without hits in the cell
+        var = var_a + tensordot(matrix ** 2, var_b, 1)
+        diff = where(good, fractions_a - tensordot(matrix, fractions_b, 1), 0)
+        with errstate(divide='ignore', invalid='ignore'):
+            weights = where(good, 1 / var, 0)
+            sum_weights = weights.sum(axis=0)
+            mean_diff = (weights * diff).sum(axis=0) / sum_weights
+            # the interpolated fractions share the runs of plan_b: var = sum_k w_k^2 var_a_k + sum_j var_b_j (sum_k w_k m_kj)^2
+            mean_err = sqrt(((weights ** 2 * var_a).sum(axis=0) + (var_b * tensordot(matrix.T, weights, 1) ** 2).sum(axis=0))) / sum_weights
+            significance = mean_diff / mean_err
+            z = where(good, diff / sqrt(var), 0)
+        empty = ~(sum_weights > 0)
+        mean_diff[empty], mean_err[empty], significance[empty] = 0, 0, 0
+        return {'rates': rates_a[matched], 'diff': diff, 'z': z, 'mean_diff': mean_diff, 'mean_err': mean_err, 'significance': significance,
+                'p_value': vectorize(erfc)(abs(significance) / sqrt(2))}
+
+    def compare_plans(self, plans, reference, level='roc'):
+        """ :return: dict with the comparisons of all plans to the reference plan """
+        return {plan: self.compare(plan, reference, level) for plan in plans}
+
+    def print_comparison(self, plan_a, plan_b):
+        dic = self.compare(plan_a, plan_b)
+        print 'Comparison of the {n}s of {a} and {b} at {i} matched hit rates:\n'.format(n=' '.join(self.Name.split('_')), a=plan_a, b=plan_b, i=dic['rates'].size)
+        print 'ROC  Difference [per mill]  Significance'
+        for roc, (diff, err, z) in enumerate(zip(dic['mean_diff'], dic['mean_err'], dic['significance'])):
+            print '{r}  {d:10.4f} +- {e:6.4f}  {z:12.2f}'.format(r=str(roc).rjust(3), d=diff * 1000, e=err * 1000, z=z)
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(prog='PlanComparison')
+    parser.add_argument('plans', nargs='?', help='two run plans', default='[2, 4]')
+    args = parser.parse_args()
+
+    print_banner('STARTING PLAN COMPARISON')
+
+    z = PlanComparison()
+    z.print_comparison(*loads(args.plans))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# --------------------------------------------------------
+#       Client for the result server, which runs without ROOT
+# created on October 19th 2026
+# --------------------------------------------------------
+
+from sys import path
+from os.path import join, dirname, realpath
+path.insert(1, join(dirname(realpath(__file__)), 'src'))
+from Utils import make_record_array
+from multiprocessing.connection import Client
+from tempfile import gettempdir
+from os import getgid, lstat
+from stat import S_ISDIR, S_ISREG
+from grp import getgrnam, getgrgid
+
+
+def get_group_id(group=None):
+    """ :return: id of the group which shares the server (default: primary group of the current user) """
+    return getgid() if group is None else getgrnam(group).gr_gid
+
+
+def get_socket_dir(group=None):
+    return join(gettempdir(), 'procErrorResults-{g}'.format(g=getgrgid(get_group_id(group)).gr_name))
+
+
+def get_address(socket_dir):
+    return join(socket_dir, 'results.sock')
+
+
+def get_key_file(socket_dir):
+    return join(socket_dir, 'authkey')
+
+
+def check_group_access(file_name, gid, is_type=S_ISDIR):
+    """ Makes sure that the file is of the right type (no link), belongs to the group and gives no access to others. """
+    info = lstat(file_name)
+    if not is_type(info.st_mode) or info.st_gid != gid or info.st_mode & 07:
+        raise IOError('{f} has to belong to the group {g} without access for others'.format(f=file_name, g=getgrgid(gid).gr_name))
+
+
+def load_authkey(socket_dir, gid):
+    """ :return: the random key of the server, which is only readable by the group """
+    check_group_access(socket_dir, gid)
+    check_group_access(get_key_file(socket_dir), gid, S_ISREG)
+    f = open(get_key_file(socket_dir), 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class ResultClient(object):
+    """ Thin client for the ResultServer, e.g. ResultClient().query(16, 'get_summary') or ResultClient().query_plan(2, 'get_event_size_fit') """
+
+    def __init__(self, group=None):
+        socket_dir = get_socket_dir(group)
+        self.Connection = Client(get_address(socket_dir), 'AF_UNIX', authkey=load_authkey(socket_dir, get_group_id(group)))
+
+    def request(self, kind, key, method, *args, **kwargs):
+        self.Connection.send((kind, key, method, args, kwargs))
+        status, value = self.Connection.recv()
+        if status != 'ok':
+            raise RuntimeError(value)
+        return value
+
+    def query(self, run, method, *args, **kwargs):
+        return self.request('run', run, method, *args, **kwargs)
+
+    def query_plan(self, plan, method, *args, **kwargs):
+        """ :return: list with the results of the method for all runs of the run plan """
+        return self.request('plan', plan, method, *args, **kwargs)
+
+    def get_summaries(self, plan):
+        return make_record_array(self.query_plan(plan, 'get_summary'))
+
+    def close(self):
+        self.Connection.close()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# --------------------------------------------------------
+#       Local service that keeps the per-run results in memory
+# created on October 19th 2026
+# --------------------------------------------------------
+
+from Base import Base
+from ErrorAnalyser import ErrorAnalyser
+from RunSelection import RunSelection
+from ResultClient import get_group_id, get_socket_dir, get_address, get_key_file, check_group_access, load_authkey
+from Utils import print_banner, log_message, log_warning, log_critical, make_runplan_string
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from threading import Thread, Lock
+from collections import OrderedDict
+from argparse import ArgumentParser
+from os.path import exists
+from os import remove, makedirs, chmod, chown, urandom, open as os_open, write, close, O_WRONLY, O_CREAT, O_EXCL
+from socket import error as socket_error
+import ROOT
+
+
+class ResultServer(Base):
+    """ Serves the numeric queries of ErrorAnalyser over a unix socket. The analyses (with their accumulators) of the recently used runs are kept in a
+        size bounded LRU cache, so clients reuse the warm state. Requests for the same run are serialised, hence parallel requests cost one computation.
+        The socket lives in a directory which only the members of one group (e.g. the shifters) can access and clients have to authenticate with a
+        random key from that directory before any request is unpickled. """
+
+    FileSize = 10 * 1024 * 1024  # estimate of the memory of an open file and its tree without the tree cache
+
+    Methods = ['get_summary', 'get_hit_rate', 'get_event_rate', 'get_time_evolution', 'get_event_size_fit', 'get_error_correlations', 'get_roc_correlations',
+               'get_occupancy_map', 'get_error_map', 'get_column_hits', 'get_buffer_map', 'calc_buffer_proportion', 'get_buffer_errors', 'get_invalid_address', 'get_invalid_pulse_height']
+    QuietMethods = ['get_hit_rate', 'get_event_rate', 'calc_buffer_proportion']  # methods which print by default
+
+    def __init__(self, group=None, max_size=4e9, max_runs=20):
+
+        Base.__init__(self)
+        self.GroupID = get_group_id(group)
+        self.SocketDir = get_socket_dir(group)
+        self.Address = get_address(self.SocketDir)
+        self.MaxSize = max_size
+        self.MaxRuns = max_runs
+
+        self.Cache = OrderedDict()
+        self.Sizes = {}
+        self.CacheLock = Lock()
+        self.RunLocks = {}
+        self.Selection = RunSelection()
+
+        ROOT.ROOT.EnableThreadSafety()
+
+    def get_run_lock(self, run):
+        with self.CacheLock:
+            return self.RunLocks.setdefault(run, Lock())
+
+    def get_analysis(self, run):
+        """ :return: the cached analysis of the run (most recently used runs are at the end) """
+        with self.CacheLock:
+            if run in self.Cache:
+                self.Cache[run] = self.Cache.pop(run)
+                return self.Cache[run]
+        ana = ErrorAnalyser(run)
+        with self.CacheLock:
+            self.Cache[run] = ana
+        return ana
+
+    def get_size(self, ana):
+        """ :return: estimated memory size of the analysis: accumulator, open files and their tree caches """
+        size = self.FileSize + ana.Tree.GetCacheSize() + (ana.Accumulator.get_size() if ana.Accumulator is not None else 0)
+        if ana.Preview is not None and ana.Preview.File.IsOpen():
+            size += self.FileSize + ana.Preview.Tree.GetCacheSize()
+        return size
+
+    def update_size(self, run, ana):
+        """ Updates the memory size of the run and evicts the least recently used runs if the cache exceeds the maximum size or number of runs. """
+        with self.CacheLock:
+            self.Sizes[run] = self.get_size(ana)
+            for old_run in list(self.Cache):
+                if sum(self.Sizes.itervalues()) <= self.MaxSize and len(self.Cache) <= self.MaxRuns:
+                    break
+                if old_run == run or self.RunLocks[old_run].locked():  # still in use
+                    continue
+                old_ana = self.Cache.pop(old_run)
+                old_ana.File.Close()
+                if old_ana.Preview is not None and old_ana.Preview.File.IsOpen():
+                    old_ana.Preview.File.Close()
+                self.Sizes.pop(old_run, None)
+                log_message('Removed run {r} from the cache'.format(r=old_run))
+
+    def query_run(self, run, method, args=(), kwargs=None):
+        if method not in self.Methods:
+            raise ValueError('Unknown method "{m}", choose from {l}'.format(m=method, l=self.Methods))
+        with self.get_run_lock(run):
+            ana = self.get_analysis(run)
+            kwargs = {} if kwargs is None else dict(kwargs)
+            if method in self.QuietMethods:
+                kwargs['prnt'] = False
+            value = getattr(ana, method)(*args, **kwargs)
+            self.update_size(run, ana)
+        return value
+
+    def get_plan_runs(self, plan):
+        self.Selection.RunPlan = self.Selection.load_runplan()
+        plan = make_runplan_string(plan)
+        if plan not in self.Selection.RunPlan:
+            raise ValueError('Run plan {p} does not exist!'.format(p=plan))
+        return [int(run) for run in self.Selection.Catalogue.get_column('run', self.Selection.RunPlan[plan]['runs'])]
+
+    def handle(self, conn):
+        try:
+            while True:
+                request = conn.recv()
+                try:
+                    kind, key, method, args, kwargs = request
+                    if kind == 'plan':
+                        value = [self.query_run(run, method, args, kwargs) for run in self.get_plan_runs(key)]
+                    else:
+                        value = self.query_run(int(key), method, args, kwargs)
+                    conn.send(('ok', value))
+                except Exception as err:
+                    log_warning('Request {r} failed: {e}'.format(r=request, e=err))
+                    conn.send(('error', '{t}: {e}'.format(t=type(err).__name__, e=err)))
+        except (EOFError, IOError):
+            pass
+        finally:
+            conn.close()
+
+    def is_running(self):
+        """ :return: whether another server answers on the socket """
+        if not exists(self.Address):
+            return False
+        try:
+            Client(self.Address, 'AF_UNIX', authkey=load_authkey(self.SocketDir, self.GroupID)).close()
+        except AuthenticationError:
+            return True
+        except (socket_error, IOError, EOFError):
+            return False
+        return True
+
+    def init_socket_dir(self):
+        """ Creates the socket directory of the group, removes a stale socket and writes a new random key which only the group can read.
+            :return: the key """
+        if not exists(self.SocketDir):
+            makedirs(self.SocketDir)
+            chown(self.SocketDir, -1, self.GroupID)
+            chmod(self.SocketDir, 0770)
+        check_group_access(self.SocketDir, self.GroupID)
+        if self.is_running():
+            log_critical('Another result server is already running on {a}'.format(a=self.Address))
+        for file_name in [self.Address, get_key_file(self.SocketDir)]:
+            if exists(file_name):
+                remove(file_name)
+        f = os_open(get_key_file(self.SocketDir), O_WRONLY | O_CREAT | O_EXCL, 0600)
+        write(f, urandom(32))
+        close(f)
+        chown(get_key_file(self.SocketDir), -1, self.GroupID)
+        chmod(get_key_file(self.SocketDir), 0640)
+        return load_authkey(self.SocketDir, self.GroupID)
+
+    def run(self):
+        listener = Listener(self.Address, 'AF_UNIX', authkey=self.init_socket_dir())
+        chown(self.Address, -1, self.GroupID)
+        chmod(self.Address, 0660)
+        log_message('Serving results on {a}'.format(a=self.Address))
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, IOError) as err:
+                    log_warning('Rejected connection: {e}'.format(e=err))
+                    continue
+                thread = Thread(target=self.handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        except KeyboardInterrupt:
+            log_message('Shutting down the result server')
+        finally:
+            listener.close()
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(prog='ResultServer')
+    parser.add_argument('-s', '--size', nargs='?', help='maximum cache size in GB', default=4, type=float)
+    parser.add_argument('-n', '--runs', nargs='?', help='maximum number of cached runs', default=20, type=int)
+    parser.add_argument('-g', '--group', nargs='?', help='group which shares the server (default: primary group of the user)', default=None)
+    args = parser.parse_args()
+
+    print_banner('STARTING RESULT SERVER')
+
+    z = ResultServer(args.group, args.size * 1e9, args.runs)
+    z.run()
@@ -8,9 +8,9 @@ from Base import Base
 from os.path import join, isfile
 from json import load, dump
 from glob import glob
-from Utils import log_message, print_banner, log_warning, make_runplan_string
+from Utils import log_message, print_banner, log_warning, make_runplan_string, file_lock, atomic_write
 from collections import OrderedDict
-from copy import deepcopy
+from RunCatalogue import RunCatalogue
 
 
 class RunSelection(Base):
@@ -21,6 +21,7 @@ class RunSelection(Base):
 
         self.RunPlan = self.load_runplan()
         self.RunInfo = self.load_run_info()
+        self.Catalogue = RunCatalogue(self.RunInfo, self.RunPlan)
         self.Selection = OrderedDict()
 
         self.SelectedRunPlan = None
@@ -74,19 +75,15 @@ class RunSelection(Base):
 
     def show_run_plans(self):
         """ Print a list of all run plans from the current test campaign to the console. """
-        old = deepcopy(self.Selection)
         print 'RUN PLAN:'
         print '  Nr.    {r}  {t}  {ct}  {v}  {cu}'.format(r='Range'.ljust(16), t='Trim', ct='ctrlreg', v='Voltage [kV]'.ljust(14), cu='Current [mA]'.ljust(14))
+        summaries = self.Catalogue.get_plan_summaries(self.RunPlan)
         for plan, info in sorted(self.RunPlan.iteritems()):
-            self.reset_selection()
-            self.select_runs_from_runplan(plan)
-            runs = info['runs']
-            run_string = '[{min}, ... , {max}]'.format(min=str(runs[0]).zfill(3), max=str(runs[-1]).zfill(3))
-            voltages, currents = [dic['HV'] for run, dic in self.RunInfo.iteritems() if run in runs], [dic['Current'] for run, dic in self.RunInfo.iteritems() if run in runs]
-            volt_str = '[{min}, ... , {max}]'.format(min=str(min(voltages)).zfill(2), max=str(max(voltages)).zfill(2))
-            cur_str = '[{min}, ... , {max}]'.format(min=str(min(currents)).zfill(2), max=str(max(currents)).zfill(2))
+            dic = summaries[plan]
+            run_string = '[{min}, ... , {max}]'.format(min=str(dic['runs'][0]).zfill(3), max=str(dic['runs'][1]).zfill(3))
+            volt_str = '[{min}, ... , {max}]'.format(min=str(dic['hv'][0]).zfill(2), max=str(dic['hv'][1]).zfill(2)) if dic['hv'] is not None else '--'.ljust(14)
+            cur_str = '[{min}, ... , {max}]'.format(min=str(dic['current'][0]).zfill(2), max=str(dic['current'][1]).zfill(2)) if dic['current'] is not None else '--'
             print '  {nr}:  {r}  {t}  {ct}  {v}  {cu}'.format(nr=plan.ljust(4), r=run_string, t=str(info['trim']).ljust(4), ct=str(info['ctrlreg']).ljust(7), v=volt_str, cu=cur_str)
-        self.Selection = old
 
     def select_run(self, run_number, deselect=False):
         if run_number not in self.RunInfo:
@@ -97,37 +94,72 @@ class RunSelection(Base):
         self.select_run(run_number, deselect=True)
 
     def select_runs_in_range(self, min_run, max_run, deselect=False):
-        for run in self.Selection:
-            if max_run >= run >= min_run:
-                self.select_run(run, deselect)
+        for run in self.Catalogue.get_column('run')[self.Catalogue.find('run', min_run, max_run)]:
+            self.select_run(int(run), deselect)
 
     def deselect_runs_in_range(self, min_run, max_run):
         self.select_runs_in_range(min_run, max_run, deselect=True)
 
+    def select_runs(self, deselect=False, **conditions):
+        """ Selects all runs fulfilling the conditions, e.g. select_runs(ctrlreg=16, current='>20'). See RunCatalogue.query for the syntax. """
+        runs = self.Catalogue.query(**conditions)
+        for run in runs:
+            self.select_run(int(run), deselect)
+        return runs.tolist()
+
+    def deselect_runs(self, **conditions):
+        return self.select_runs(deselect=True, **conditions)
+
     def select_runs_from_runplan(self, plan_nr):
+        """ Selects exactly the runs listed in the run plan. Runs between the first and the last run of the plan which are not listed (e.g. runs
+            excluded by a query, see add_query_to_runplan) are not selected anymore, use select_runs_in_range for the full range. """
         self.reset_selection()
         plan = make_runplan_string(plan_nr)
         try:
             runs = self.RunPlan[plan]['runs']
             self.SelectedRunPlan = plan
-            self.select_runs_in_range(runs[0], runs[-1])
+            for run in self.Catalogue.get_column('run', runs):
+                self.select_run(int(run))
         except KeyError:
             log_warning('Run plan {r} does not exist!'.format(r=plan))
 
+    def update_runplans(self, func):
+        """ Applies func to the run plans of the current file under a lock and publishes the result atomically, so plans saved by parallel sessions are kept. """
+        with file_lock(self.RunPlanPath):
+            runplan = self.load_runplan() if isfile(self.RunPlanPath) else {}
+            func(runplan)
+            atomic_write(self.RunPlanPath, lambda f: dump(runplan, f, indent=2, sort_keys=True))
+        self.RunPlan = runplan
+        self.Catalogue = RunCatalogue(self.RunInfo, self.RunPlan)
+
     def save_runplan(self, runplan=None):
-        f = open(self.RunPlanPath, 'r+' if isfile(self.RunPlanPath) else 'w')
+        """ Merges the given run plans (dict: plan nr -> plan, default: all plans in memory) into the current file. """
         runplan = self.RunPlan if runplan is None else runplan
-        dump(runplan, f, indent=2, sort_keys=True)
-        f.truncate()
-        f.close()
+        self.update_runplans(lambda plans: plans.update(runplan))
+
+    def delete_runplan(self, plan_nr):
+        """ Removes the run plan with name 'plan_nr' from the current file. """
+        plan_nr = make_runplan_string(plan_nr)
+        if plan_nr not in self.RunPlan:
+            log_warning('Run plan {r} does not exist!'.format(r=plan_nr))
+        self.update_runplans(lambda plans: plans.pop(plan_nr, None))
 
     def add_selection_to_runplan(self, plan_nr, trim, ctrlreg):
         """ Saves all selected runs as a run plan with name 'plan_nr'. """
         plan_nr = make_runplan_string(plan_nr)
         assert self.Selection, 'The run selection is completely empty!'
 
-        self.RunPlan[plan_nr] = {'runs': self.get_selected_runs(), 'trim': trim, 'ctrlreg': ctrlreg}
-        self.save_runplan()
+        self.save_runplan({plan_nr: {'runs': self.get_selected_runs(), 'trim': trim, 'ctrlreg': ctrlreg}})
+
+    def add_query_to_runplan(self, plan_nr, **conditions):
+        """ Saves all runs fulfilling the conditions as a run plan with name 'plan_nr'. The query is stored alongside the runs. """
+        plan_nr = make_runplan_string(plan_nr)
+        runs = self.Catalogue.query(**conditions).tolist()
+        if not runs:
+            log_warning('The query {q} does not match any run!'.format(q=conditions))
+            return
+        trim, ctrlreg = (conditions[col] if type(conditions.get(col)) is int else self.Catalogue.get_settings(runs, col) for col in ['trim', 'ctrlreg'])
+        self.save_runplan({plan_nr: {'runs': runs, 'trim': trim, 'ctrlreg': ctrlreg, 'query': conditions}})
 
     def get_selected_runs(self):
         """ :return: list of selected run numbers. """
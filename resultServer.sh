@@ -0,0 +1,3 @@
+#!/usr/bin/env bash
+
+python ResultServer.py $@
\ No newline at end of file
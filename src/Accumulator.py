@@ -0,0 +1,161 @@
+# --------------------------------------------------------
+#       Per-run counts which are filled in a single pass over the tree
+# created on October 19th 2026
+# --------------------------------------------------------
+
+from SparseMap import SparseMap
+from Utils import compact
+from numpy import zeros, bincount, cumsum, concatenate, arange, ceil, append, minimum, unique, log, exp, sqrt, searchsorted, dot, outer, diag, errstate, isfinite, clip
+
+
+def calc_phi_coefficients(counts, n):
+    """ :return: matrix of the correlation (phi) coefficients of the binary event flags from the matrix of joint counts (single counts on the diagonal) """
+    counts = counts.astype('f8')
+    single = diag(counts)
+    with errstate(divide='ignore', invalid='ignore'):
+        phi = (n * counts - outer(single, single)) / sqrt(outer(single * (n - single), single * (n - single)))
+    phi[~isfinite(phi)] = 0  # no events with or without the flag
+    return clip(phi, -1, 1)
+
+
+class RunAccumulator(object):
+    """ Collects all per-run quantities from chunks of hits (see ErrorAnalyser.read_hits). Only plain arrays are stored, so it can be pickled.
+        The counts per event are kept as cumulative sums over blocks of 'Granularity' events for every quantity and ROC (the last row holds the
+        sum over all ROCs). The counts in any range of events are then just the difference of two entries.
+        All counts are filled as 64 bit integers and stored with the narrowest unsigned integer dtype which fits after the scan (see finish). """
+
+    Version = 5
+
+    def __init__(self, n_entries, error_names, n_rocs=16, n_cols=52, n_rows=80, granularity=1000):
+
+        self.NEntries = n_entries
+        self.ErrorNames = error_names
+        self.Names = ['hits', 'valid_hits'] + error_names
+        self.NRocs = n_rocs
+        self.MapShape = (n_rocs, n_cols, n_rows)
+        self.Granularity = int(granularity)
+        self.NBlocks = int(ceil(n_entries / float(self.Granularity)))
+
+        self.BlockCounts = zeros((len(self.Names), self.NRocs + 1, self.NBlocks), 'u8')
+        self.CumSum = None
+        self.EventSizes = zeros(1, 'u8')  # number of events for every number of hits per event
+        # number of events in which both error types / both ROCs (for every error type) have errors, the diagonal holds the single counts
+        self.TypeCorrelation = zeros((len(error_names), len(error_names)), 'u8')
+        self.RocCorrelation = zeros((len(error_names), self.NRocs, self.NRocs), 'u8')
+        # pixel maps: dense for all hits, sparse for the (rare) errors
+        self.Occupancy = zeros(self.MapShape, 'u8')
+        self.ErrorMaps = {name: SparseMap(self.MapShape) for name in error_names}
+
+    def fill(self, hits):
+        blocks = (hits['event'] // self.Granularity).astype('i8')
+        planes = hits['plane'].astype('i8')
+        in_range = (planes >= 0) & (planes < self.NRocs)
+        indices = planes[in_range] * self.NBlocks + blocks[in_range]
+        weights = [None, hits['buffer_corruption'] < 1] + [hits[name] * (hits[name] > 0) for name in self.ErrorNames]
+        for i, w in enumerate(weights):
+            counts = bincount(indices, weights=None if w is None else w[in_range], minlength=self.NRocs * self.NBlocks).astype('u8').reshape(self.NRocs, self.NBlocks)
+            self.BlockCounts[i, :self.NRocs] += counts
+            self.BlockCounts[i, self.NRocs] += counts.sum(axis=0)
+        self.fill_event_sizes(hits['event'])
+        self.fill_correlations(hits, planes, in_range)
+        self.fill_maps(hits)
+
+    def fill_event_sizes(self, events):
+        sizes = bincount(unique(events, return_counts=True)[1]).astype('u8')
+        if sizes.size > self.EventSizes.size:
+            self.EventSizes = concatenate([self.EventSizes, zeros(sizes.size - self.EventSizes.size, 'u8')])
+        self.EventSizes[:sizes.size] += sizes
+
+    def fill_correlations(self, hits, planes, in_range):
+        events, inverse = unique(hits['event'], return_inverse=True)
+        flags = zeros((events.size, len(self.ErrorNames)), 'u8')
+        for i, name in enumerate(self.ErrorNames):
+            error = hits[name] > 0
+            flags[inverse[error], i] = 1
+            roc_flags = zeros((events.size, self.NRocs), 'u8')
+            roc_flags[inverse[error & in_range], planes[error & in_range]] = 1
+            roc_flags = roc_flags[flags[:, i] > 0]  # only events with errors contribute
+            self.RocCorrelation[i] += dot(roc_flags.T, roc_flags)
+        flags = flags[flags.any(axis=1)]
+        self.TypeCorrelation += dot(flags.T, flags)
+
+    def fill_maps(self, hits):
+        n_rocs, n_cols, n_rows = self.MapShape
+        good = (hits['plane'] >= 0) & (hits['plane'] < n_rocs) & (hits['col'] >= 0) & (hits['col'] < n_cols) & (hits['row'] >= 0) & (hits['row'] < n_rows)
+        pixels = (hits['plane'][good].astype('i8') * n_cols + hits['col'][good]) * n_rows + hits['row'][good]
+        self.Occupancy += bincount(pixels, minlength=n_rocs * n_cols * n_rows).astype('u8').reshape(self.MapShape)
+        for name in self.ErrorNames:
+            error = hits[name] > 0
+            self.ErrorMaps[name] += SparseMap.from_hits(hits['plane'][error], hits['col'][error], hits['row'][error], shape=self.MapShape)
+
+    def finish(self):
+        """ Converts the block counts into cumulative sums with a leading zero. """
+        self.CumSum = compact(concatenate([zeros(self.BlockCounts.shape[:2] + (1,), 'u8'), cumsum(self.BlockCounts, axis=-1)], axis=-1))
+        self.BlockCounts = None
+        self.EventSizes[0] = self.NEntries - self.EventSizes[1:].sum()  # events without hits
+        self.EventSizes, self.TypeCorrelation, self.RocCorrelation, self.Occupancy = [compact(a) for a in [self.EventSizes, self.TypeCorrelation, self.RocCorrelation, self.Occupancy]]
+
+    def get_cumsum(self, name, roc=None):
+        return self.CumSum[self.Names.index(name), self.NRocs if roc is None else roc]
+
+    def get_total(self, name, roc=None):
+        return self.get_cumsum(name, roc)[-1]
+
+    def get_roc_totals(self, name):
+        """ :return: total counts of 'name' for every ROC """
+        return self.CumSum[self.Names.index(name), :self.NRocs, -1]
+
+    def get_hit_rate(self):
+        return self.get_total('valid_hits') / (2.5e-8 * self.NEntries)
+
+    def get_column_hits(self):
+        """ :return: valid hits per column with shape (NRocs, NCols), i.e. all hits minus the buffer corruptions in the rows of the ROC (no overflow row) """
+        return compact(self.Occupancy.sum(axis=2).astype('i8') - self.ErrorMaps['buffer_corruption'].get_column_counts())
+
+    def get_scan_summary(self):
+        """ :return: dict with the hit rate and the errors and valid hits per ROC and per column, small enough to be loaded quickly for many runs """
+        return {'hit_rate': self.get_hit_rate(), 'roc_valid_hits': self.get_roc_totals('valid_hits'), 'column_valid_hits': self.get_column_hits(),
+                'roc_errors': {name: self.get_roc_totals(name) for name in self.ErrorNames},
+                'column_errors': {name: self.ErrorMaps[name].get_column_counts() for name in self.ErrorNames}}
+
+    def get_block_edges(self, bin_width):
+        """ :return: block indices of the bin edges for bins of (about) bin_width events """
+        width = max(1, int(round(bin_width / float(self.Granularity))))
+        edges = arange(0, self.NBlocks + 1, width)
+        return edges if edges[-1] == self.NBlocks else append(edges, self.NBlocks)
+
+    def get_time_evolution(self, name='buffer_corruption', roc=None, bin_width=5e3):
+        """ :return: bin edges [event number], counts of 'name' and counts of valid hits in every bin """
+        edges = self.get_block_edges(bin_width)
+        values, hits = self.get_cumsum(name, roc)[edges], self.get_cumsum('valid_hits', roc)[edges]
+        return minimum(edges * self.Granularity, self.NEntries), (values[1:] - values[:-1]).astype('f8'), (hits[1:] - hits[:-1]).astype('f8')
+
+    def get_event_size_fit(self, tail_prob=1e-3, min_expected=5):
+        """ Maximum likelihood estimate of the Poisson mean of the event size distribution (which is just the mean number of hits per event)
+            :return: dict with lambda, its uncertainty, Pearson chi2/ndf of the bins with at least min_expected expected events and the excess of
+                     events in the tail above the (1 - tail_prob) quantile of the Poisson distribution (overflow & pile-up) """
+        counts = self.EventSizes.astype('f8')
+        n, k = counts.sum(), arange(counts.size)
+        lam = (k * counts).sum() / n
+        log_factorial = concatenate([[0], cumsum(log(arange(1, counts.size + 100)))])
+        expected = n * exp(arange(log_factorial.size) * log(lam) - lam - log_factorial) if lam > 0 else append(n, zeros(log_factorial.size - 1))
+        threshold = min(searchsorted(cumsum(expected) / n, 1 - tail_prob), counts.size)
+        expected = expected[:counts.size]
+        good = expected >= min_expected
+        chi2 = ((counts[good] - expected[good]) ** 2 / expected[good]).sum()
+        return {'lambda': lam, 'lambda_err': sqrt(lam / n), 'chi2': chi2, 'ndf': max(good.sum() - 2, 1), 'tail_threshold': threshold,
+                'tail_excess': (counts[threshold + 1:].sum() - (n - expected[:threshold + 1].sum())) / n}
+
+    def get_error_correlations(self):
+        """ :return: joint event counts and phi coefficients between the error types """
+        return self.TypeCorrelation, calc_phi_coefficients(self.TypeCorrelation, self.NEntries)
+
+    def get_roc_correlations(self, name='buffer_corruption'):
+        """ :return: joint event counts and phi coefficients of the errors 'name' between all pairs of ROCs """
+        counts = self.RocCorrelation[self.ErrorNames.index(name)]
+        return counts, calc_phi_coefficients(counts, self.NEntries)
+
+    def get_size(self):
+        """ :return: memory size of all arrays in bytes """
+        arrays = [self.CumSum, self.BlockCounts, self.EventSizes, self.TypeCorrelation, self.RocCorrelation, self.Occupancy]
+        return sum(a.nbytes for a in arrays if a is not None) + sum(m.Indices.nbytes + m.Counts.nbytes for m in self.ErrorMaps.itervalues())
@@ -5,8 +5,8 @@
 # --------------------------------------------------------
 
 from os.path import join
-from Utils import ensure_dir, log_warning
-from pickle import dump, load
+from Utils import ensure_dir, log_warning, file_lock, atomic_write
+from pickle import dump, load, UnpicklingError, HIGHEST_PROTOCOL
 
 
 class Pickler(object):
@@ -35,19 +35,31 @@ class Pickler(object):
             log_warning('Set the path first!')
         return self.Path
 
+    @staticmethod
+    def load(path):
+        f = open(path, 'rb')
+        try:
+            return load(f)
+        finally:
+            f.close()
+
     def run(self, function, value=None, params=None):
+        """ Returns the pickled value or computes and saves it. Files are published atomically and the computation is guarded by a file lock,
+            so a second process asking for the same entry waits for the first one and reads its result instead of computing it again.
+            The binary protocol stores the numpy arrays as raw buffers. """
+        path = self.get_path()
         if value is not None:
-            f = open(self.get_path(), 'w')
-            dump(value, f)
-            f.close()
+            with file_lock(path):
+                atomic_write(path, lambda f: dump(value, f, HIGHEST_PROTOCOL), 'wb')
             return value
         try:
-            f = open(self.get_path(), 'r')
-            ret_val = load(f)
-            f.close()
-        except IOError:
-            f = open(self.get_path(), 'w')
-            ret_val = function() if params is None else function(params)
-            dump(ret_val, f)
-            f.close()
+            return self.load(path)
+        except (IOError, EOFError, UnpicklingError):
+            pass
+        with file_lock(path):
+            try:
+                return self.load(path)
+            except (IOError, EOFError, UnpicklingError):
+                ret_val = function() if params is None else function(params)
+                atomic_write(path, lambda f: dump(ret_val, f, HIGHEST_PROTOCOL), 'wb')
         return ret_val
@@ -0,0 +1,47 @@
+# --------------------------------------------------------
+#       Background reader to warm the file cache of upcoming runs
+# created on October 19th 2026
+# --------------------------------------------------------
+
+from subprocess import Popen
+from os import devnull
+from Utils import log_warning
+
+
+class Prefetcher(object):
+    """ Reads the files of the upcoming runs into the page cache of the node while the current run is analysed. The files are read by separate
+        'cat' processes: PyROOT keeps the GIL during TTree::Draw, so a python reader thread would hardly run while the analysis is busy. """
+
+    def __init__(self, file_names, n_ahead=1):
+
+        self.FileNames = file_names
+        self.NAhead = n_ahead
+
+        self.Processes = {}
+        self.DevNull = open(devnull, 'w')
+
+    def advance(self, i):
+        """ Tells the prefetcher that the analysis started processing file i, starts reading the next n_ahead files and stops the readers of passed files. """
+        for j in xrange(i + 1, min(i + 1 + self.NAhead, len(self.FileNames))):
+            if j not in self.Processes:
+                self.Processes[j] = self.warm(self.FileNames[j])
+        for j in [j for j in self.Processes if j < i]:
+            self.kill(self.Processes.pop(j))
+
+    def warm(self, file_name):
+        try:
+            return Popen(['cat', file_name], stdout=self.DevNull)
+        except OSError as err:
+            log_warning('Could not prefetch {f}: {e}'.format(f=file_name, e=err))
+
+    @staticmethod
+    def kill(process):
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+
+    def stop(self):
+        for process in self.Processes.itervalues():
+            self.kill(process)
+        self.Processes = {}
+        self.DevNull.close()
@@ -0,0 +1,164 @@
+# --------------------------------------------------------
+#       Approximate error rates from a random subset of entry clusters
+# created on October 19th 2026
+# --------------------------------------------------------
+
+from numpy import zeros, sqrt, bincount, errstate
+from numpy.random import RandomState
+from threading import Lock, Thread
+from multiprocessing import Pool
+from itertools import izip_longest
+from Utils import compact, add_counts, log_message
+from ROOT import TFile
+
+Previews = {}  # previews which are refined in the background, inherited by the forked worker processes
+Trees = {}  # file handles of the worker processes
+
+
+def read_counts(job):
+    """ Reads cluster i of the preview of the run in a worker process, with its own handle of the run file. :return: run, i and the counts of the cluster """
+    run, i = job
+    preview = Previews[run]
+    if run not in Trees:
+        f = TFile(preview.FileName)
+        Trees[run] = f, f.Get('tree')
+        preview.Analysis.init_tree_cache(max(n for first, n in preview.Chunks), Trees[run][1])
+    return run, i, preview.count(i, preview.Analysis.read_hits(*preview.Chunks[i], tree=Trees[run][1]))
+
+
+def refine_in_background(previews, n_processes=1):
+    """ Reads the remaining clusters of the previews (dict: run -> Preview) in worker processes, the runs in turns. A thread of this process only
+        adds up the returned counts, so neither the GIL nor ROOT is held for the reading and the interactive session stays usable.
+        :return: the collecting thread """
+    Previews.update(previews)
+    jobs = [job for jobs in izip_longest(*[[(run, i) for i in preview.get_todo()] for run, preview in previews.iteritems()]) for job in jobs if job is not None]
+    pool = Pool(n_processes)
+
+    def collect():
+        for run, i, counts in pool.imap_unordered(read_counts, jobs):
+            previews[run].add(i, *counts)
+        pool.close()
+        pool.join()
+        log_message('The previews of {n} runs converged to the full results'.format(n=len(previews)))
+    thread = Thread(target=collect, name='PreviewRefinement')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class Preview(object):
+    """ Processes the entry clusters of a run in random order and keeps the counts of every processed cluster. The error fractions are
+        estimated with a ratio estimator whose uncertainty accounts for the cluster sampling. Once all clusters are processed the values are exact.
+        The clusters are read from a separate handle of the run file, in the background from worker processes (see refine_in_background). """
+
+    def __init__(self, analysis, seed=0):
+
+        self.Analysis = analysis
+        self.ErrorNames = analysis.ErrorNames
+        self.Chunks = analysis.get_clusters()
+        self.Order = RandomState(seed).permutation(len(self.Chunks))
+        self.Done = zeros(len(self.Chunks), bool)
+        self.NDone = 0
+        self.Lock = Lock()
+        self.FileName = analysis.File.GetName()
+        self.File = TFile(self.FileName)
+        self.Tree = self.File.Get('tree')
+        analysis.init_tree_cache(max(n for first, n in self.Chunks), self.Tree)
+
+        # integer counts: per chunk [entries, valid hits, errors...], per column [valid hits, errors...] (narrowest dtype that fits, see add_counts)
+        self.Counts = zeros((len(self.Chunks), 2 + len(self.ErrorNames)), 'u8')
+        self.ColumnCounts = zeros((1 + len(self.ErrorNames), analysis.NRocs, analysis.NCols), 'u1')
+
+    def is_done(self):
+        return self.NDone == len(self.Chunks)
+
+    def get_todo(self):
+        """ :return: the clusters which are not processed yet, in processing order """
+        with self.Lock:
+            return [i for i in self.Order if not self.Done[i]]
+
+    def get_processed_fraction(self):
+        with self.Lock:
+            return self.Counts[self.Done, 0].sum() / float(self.Analysis.NEntries)
+
+    def refine(self, n=1):
+        """ Processes the next n clusters in this process. Once all clusters are processed the file is closed. """
+        for i in self.get_todo()[:n]:
+            self.add(i, *self.count(i, self.Analysis.read_hits(*self.Chunks[i], tree=self.Tree)))
+        if self.is_done() and self.File.IsOpen():
+            self.File.Close()
+
+    def count(self, i, hits):
+        """ :return: counts [entries, valid hits, errors...] and column counts [valid hits, errors...] of the hits of cluster i """
+        ana = self.Analysis
+        valid = hits['buffer_corruption'] < 1
+        counts = zeros(self.Counts.shape[1], 'u8')
+        counts[:2] = self.Chunks[i][1], valid.sum()
+        in_range = (hits['plane'] >= 0) & (hits['plane'] < ana.NRocs) & (hits['col'] >= 0) & (hits['col'] < ana.NCols)
+        columns = hits['plane'].astype('i8') * ana.NCols + hits['col']
+        column_counts = zeros(self.ColumnCounts.shape, 'u8')
+        column_counts[0] = bincount(columns[valid & in_range], minlength=ana.NRocs * ana.NCols).reshape(ana.NRocs, ana.NCols)
+        for j, name in enumerate(self.ErrorNames, 1):
+            values = hits[name] * (hits[name] > 0)
+            counts[1 + j] = values.sum()
+            column_counts[j] = bincount(columns[in_range], weights=values[in_range], minlength=ana.NRocs * ana.NCols).reshape(ana.NRocs, ana.NCols)
+        return counts, compact(column_counts)
+
+    def add(self, i, counts, column_counts):
+        """ Adds the counts of cluster i (see count), clusters which are already processed are ignored. The counts are compacted at the end. """
+        with self.Lock:
+            if self.Done[i]:
+                return
+            self.Counts[i] = counts
+            self.ColumnCounts = add_counts(self.ColumnCounts, column_counts)
+            self.Done[i] = True
+            self.NDone += 1
+            if self.is_done():
+                self.Counts = compact(self.Counts)
+
+    def get_error_fraction(self, name='buffer_corruption'):
+        """ :return: estimated fraction of errors per valid hit and its statistical uncertainty """
+        with self.Lock:
+            counts = self.Counts[self.Done].astype('f8')
+        x, y = counts[:, 1], counts[:, 2 + self.ErrorNames.index(name)]
+        if not x.sum():
+            return 0., 0.
+        ratio = y.sum() / x.sum()
+        n, n_tot = x.size, float(len(self.Chunks))
+        if n < 2:
+            return ratio, sqrt(y.sum()) / x.sum()
+        # variance of the ratio estimator for cluster sampling without replacement
+        var = (1 - n / n_tot) / (n * x.mean() ** 2) * ((y - ratio * x) ** 2).sum() / (n - 1)
+        return ratio, sqrt(var)
+
+    def get_hit_rate(self):
+        """ :return: estimated hit rate [Hz] and its statistical uncertainty """
+        with self.Lock:
+            counts = self.Counts[self.Done].astype('f8')
+        n, n_tot = counts.shape[0], float(len(self.Chunks))
+        entries, hits = counts[:, 0], counts[:, 1]
+        if not n:
+            return 0., 0.
+        rate = hits.sum() / (2.5e-8 * entries.sum())
+        if n < 2:
+            return rate, sqrt(hits.sum()) / (2.5e-8 * entries.sum())
+        err = sqrt((1 - n / n_tot) / (n * entries.mean() ** 2) * ((hits - rate * 2.5e-8 * entries) ** 2).sum() / (n - 1)) / 2.5e-8
+        return rate, err
+
+    def get_column_fractions(self, name='buffer_corruption'):
+        """ :return: estimated fraction of errors per valid hit for every column with shape (NRocs, NCols) """
+        with self.Lock:
+            good, bad = self.ColumnCounts[0].astype('f8'), self.ColumnCounts[1 + self.ErrorNames.index(name)]
+            with errstate(divide='ignore', invalid='ignore'):
+                fractions = bad / good
+        fractions[good == 0] = 0
+        return fractions
+
+    def print_status(self):
+        print 'Preview of run {r} ({p:5.1f}% of the events):'.format(r=self.Analysis.RunNumber, p=self.get_processed_fraction() * 100)
+        rate, err = self.get_hit_rate()
+        print '  Hit Rate:   {0:5.1f} +- {1:3.1f} MHz'.format(rate / 1e6, err / 1e6)
+        for name in self.ErrorNames:
+            value, err = self.get_error_fraction(name)
+            print '  {n}: ({v:6.4f} +- {e:6.4f}) per mill'.format(n=name.replace('_', ' ').ljust(20), v=value * 1000, e=err * 1000)
+
@@ -0,0 +1,95 @@
+# --------------------------------------------------------
+#       Run catalogue with sorted typed columns for fast run queries
+# created on October 19th 2026
+# --------------------------------------------------------
+
+from numpy import array, argsort, searchsorted, intersect1d, setdiff1d, arange, full, unique
+
+
+class RunCatalogue(object):
+    """ Stores the run infos as typed column arrays (sorted by run number) together with a sorted index for every column,
+        such that queries like 'ctrlreg=16, current>20' are resolved with binary searches instead of looping over all runs. """
+
+    Columns = ['run', 'hv', 'current', 'trim', 'ctrlreg']
+    Operators = ['>=', '<=', '!=', '==', '>', '<', '=']
+
+    def __init__(self, run_info, run_plan):
+
+        runs = sorted(run_info)
+        self.Data = {'run': array(runs, 'i4'),
+                     'hv': array([run_info[run]['HV'] for run in runs], 'i4'),
+                     'current': array([run_info[run]['Current'] for run in runs], 'i4')}
+        self.Data['trim'], self.Data['ctrlreg'] = self.load_plan_settings(run_plan)
+
+        self.Index = {col: argsort(values, kind='mergesort') for col, values in self.Data.iteritems()}
+        self.Sorted = {col: self.Data[col][self.Index[col]] for col in self.Data}
+
+    def __len__(self):
+        return self.Data['run'].size
+
+    def load_plan_settings(self, run_plan):
+        """ :return: trim and ctrlreg arrays for all runs, taken from the run plans (-1 if the run is not in any plan). """
+        trim, ctrlreg = full(len(self), -1, 'i4'), full(len(self), -1, 'i4')
+        for plan, info in sorted(run_plan.iteritems()):
+            if type(info['trim']) is not int or type(info['ctrlreg']) is not int:
+                continue
+            indices = self.get_indices(info['runs'])
+            trim[indices] = info['trim']
+            ctrlreg[indices] = info['ctrlreg']
+        return trim, ctrlreg
+
+    def get_indices(self, runs):
+        """ :return: positions of the given run numbers in the column arrays, runs without data are skipped. """
+        runs = array(runs, 'i4')
+        indices = searchsorted(self.Data['run'], runs).clip(0, max(len(self) - 1, 0))
+        return indices[self.Data['run'][indices] == runs] if len(self) else indices[:0]
+
+    def get_column(self, col, runs=None):
+        return self.Data[col.lower()] if runs is None else self.Data[col.lower()][self.get_indices(runs)]
+
+    def find(self, col, low=None, high=None, left=True, right=True):
+        """ :return: sorted column positions with low <= value <= high (boundaries are excluded with left/right=False). """
+        col = col.lower()
+        values = self.Sorted[col]
+        i_min = 0 if low is None else searchsorted(values, low, 'left' if left else 'right')
+        i_max = len(values) if high is None else searchsorted(values, high, 'right' if right else 'left')
+        return self.Index[col][i_min:i_max]
+
+    def find_condition(self, col, condition):
+        """ Translates a single query condition into column positions. The condition may be a value (equality),
+            a [min, max] range (inclusive, None for an open end) or a string with an operator like '>20' or '!=0'. """
+        if type(condition) in [list, tuple]:
+            return self.find(col, *condition)
+        if type(condition) in [str, unicode]:
+            op = next((o for o in self.Operators if condition.strip().startswith(o)), '==')
+            value = int(condition.strip()[len(op):] if condition.strip().startswith(op) else condition)
+            if op == '!=':
+                return setdiff1d(arange(len(self)), self.find(col, value, value))
+            low = value if op in ['>=', '>', '==', '='] else None
+            high = value if op in ['<=', '<', '==', '='] else None
+            return self.find(col, low, high, left=op != '>', right=op != '<')
+        return self.find(col, condition, condition)
+
+    def query(self, **conditions):
+        """ :return: sorted run numbers fulfilling all conditions, e.g. query(ctrlreg=16, current='>20'). Raises a KeyError for unknown columns. """
+        for col in conditions:
+            if col.lower() not in self.Data:
+                raise KeyError('Unknown run catalogue column "{c}", choose from {l}'.format(c=col, l=self.Columns))
+        indices = arange(len(self))
+        for col, condition in conditions.iteritems():
+            indices = intersect1d(indices, self.find_condition(col, condition))
+        return self.Data['run'][indices]
+
+    def get_plan_summaries(self, run_plan):
+        """ :return: dict with the run, voltage and current ranges of every run plan, computed in a single pass. """
+        summaries = {}
+        for plan, info in run_plan.iteritems():
+            indices = self.get_indices(info['runs'])
+            summaries[plan] = {col: (self.Data[col][indices].min(), self.Data[col][indices].max()) if indices.size else None for col in ['run', 'hv', 'current']}
+            summaries[plan]['runs'] = (min(info['runs']), max(info['runs']))
+        return summaries
+
+    def get_settings(self, runs, col):
+        """ :return: the setting of the given column for the runs, or the list of distinct settings if they are not unique. """
+        values = unique(self.get_column(col, runs)).tolist()
+        return values[0] if len(values) == 1 else values
@@ -0,0 +1,67 @@
+# --------------------------------------------------------
+#       Sparse pixel maps for rare hits like read-out errors
+# created on October 19th 2026
+# --------------------------------------------------------
+
+from numpy import array, zeros, ones, concatenate, argsort, flatnonzero, add, bincount, ravel_multi_index, where
+from Utils import compact
+
+
+class SparseMap(object):
+    """ Pixel map that only stores the pixels with entries as sorted linear pixel indices (plane, col, row) and their counts.
+        The memory scales with the number of hit pixels instead of the number of pixels. Rows outside the ROC are stored in an extra overflow row. """
+
+    def __init__(self, shape=(16, 52, 80), indices=None, counts=None):
+
+        self.Shape = tuple(shape)
+        self.FullShape = self.Shape[:2] + (self.Shape[2] + 1,)
+        self.Indices = zeros(0, 'u4') if indices is None else indices
+        self.Counts = zeros(0, 'u1') if counts is None else counts
+
+    def __len__(self):
+        return self.Indices.size
+
+    def __add__(self, other):
+        return merge_maps([self, other])
+
+    @classmethod
+    def from_hits(cls, planes, cols, rows, weights=None, shape=(16, 52, 80)):
+        """ Creates the map from hit coordinates. Hits outside the module are dropped, rows outside the ROC go into the overflow row. """
+        planes, cols, rows = array(planes, 'i8'), array(cols, 'i8'), array(rows, 'i8')
+        good = (planes >= 0) & (planes < shape[0]) & (cols >= 0) & (cols < shape[1])
+        rows = where((rows >= 0) & (rows < shape[2]), rows, shape[2])
+        indices = ravel_multi_index((planes[good], cols[good], rows[good]), shape[:2] + (shape[2] + 1,)).astype('u4')
+        return cls(shape, *reduce_counts(indices, None if weights is None else array(weights)[good], sort=True))
+
+    def to_dense(self, overflow=False):
+        """ :return: dense array with shape (planes, cols, rows), including the overflow row if requested """
+        data = bincount(self.Indices, weights=self.Counts, minlength=self.FullShape[0] * self.FullShape[1] * self.FullShape[2]).reshape(self.FullShape)
+        return compact(data if overflow else data[..., :self.Shape[2]])
+
+    def get_column_counts(self, overflow=False):
+        """ :return: counts per column with shape (planes, cols), without the overflow row (like the dense maps) unless requested """
+        good = slice(None) if overflow else self.Indices % self.FullShape[2] < self.Shape[2]
+        return compact(bincount(self.Indices[good] // self.FullShape[2], weights=self.Counts[good], minlength=self.Shape[0] * self.Shape[1]).reshape(self.Shape[:2]))
+
+    def get_total(self):
+        return self.Counts.sum()
+
+
+def reduce_counts(indices, counts=None, sort=False):
+    """ Sorts the indices (stable, so two concatenated sorted runs are merged in linear time) and sums the counts of equal indices.
+        The sums are computed with 64 bit and stored with the narrowest dtype that fits. """
+    counts = ones(indices.size, 'u8') if counts is None else counts.astype('u8')
+    if sort:
+        order = argsort(indices, kind='mergesort')
+        indices, counts = indices[order], counts[order]
+    if not indices.size:
+        return indices, compact(counts)
+    starts = flatnonzero(concatenate([[True], indices[1:] != indices[:-1]]))
+    return indices[starts], compact(add.reduceat(counts, starts))
+
+
+def merge_maps(maps):
+    """ :return: sum of several sparse maps with the same shape """
+    maps = [m for m in maps if m is not None]
+    indices, counts = reduce_counts(concatenate([m.Indices for m in maps]), concatenate([m.Counts for m in maps]), sort=len(maps) > 1)
+    return SparseMap(maps[0].Shape, indices, counts)
@@ -5,10 +5,14 @@
 
 from datetime import datetime
 from termcolor import colored
-from os import makedirs
+from os import makedirs, rename, remove, chmod, stat
 from os import path as pth
-from os.path import dirname
+from os.path import dirname, basename, join
 from sys import exit as ex
+from fcntl import flock, LOCK_EX, LOCK_UN
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+from numpy import frombuffer, zeros, rec, min_scalar_type, promote_types
 
 
 def round_down_to(num, val):
@@ -37,6 +41,32 @@ def ensure_dir(path):
         makedirs(path)
 
 
+@contextmanager
+def file_lock(path):
+    """ Holds an advisory lock on a hidden lock file next to 'path' which coordinates all processes on the same node. """
+    f = open(join(dirname(path), '.{n}.lock'.format(n=basename(path))), 'a')
+    flock(f, LOCK_EX)
+    try:
+        yield
+    finally:
+        flock(f, LOCK_UN)
+        f.close()
+
+
+def atomic_write(path, write_func, mode='w'):
+    """ Writes the file to a temporary file in the same directory and renames it, so readers never see a partially written file. """
+    f = NamedTemporaryFile(mode, dir=dirname(path), prefix='.{n}.'.format(n=basename(path)), delete=False)
+    try:
+        write_func(f)
+        f.close()
+        chmod(f.name, stat(path).st_mode if pth.exists(path) else 0664)
+        rename(f.name, path)
+    except Exception:
+        f.close()
+        remove(f.name)
+        raise
+
+
 def print_banner(msg, symbol='='):
     print '\n{delim}\n{msg}\n{delim}\n'.format(delim=len(str(msg)) * symbol, msg=msg)
 
@@ -50,5 +80,40 @@ def make_runplan_string(nr):
     return nr.zfill(2) if len(nr) <= 2 else nr.zfill(4)
 
 
+def get_tree_values(tree, i, n, dtype='f8'):
+    """ :return: copy of the i-th variable buffer of the last TTree::Draw as numpy array """
+    if not n:
+        return zeros(0, dtype)
+    buf = tree.GetVal(i)
+    buf.SetSize(n)
+    return frombuffer(buf, count=n).astype(dtype)
+
+
+def get_count_dtype(max_value):
+    """ :return: the narrowest unsigned integer dtype which holds max_value """
+    return min_scalar_type(max(int(max_value), 0))
+
+
+def compact(arr):
+    """ :return: the count array converted to the narrowest unsigned integer dtype that fits its values """
+    return arr.astype(get_count_dtype(arr.max() if arr.size else 0))
+
+
+def add_counts(*arrays):
+    """ Sums count arrays, the result is promoted to a wider dtype if the sum could overflow the dtypes of the summands. """
+    dtype = get_count_dtype(sum(int(arr.max()) for arr in arrays if arr.size))
+    for arr in arrays:
+        dtype = promote_types(dtype, arr.dtype)
+    result = arrays[0].astype(dtype)
+    for arr in arrays[1:]:
+        result += arr
+    return result
+
+
+def make_record_array(rows):
+    """ :return: numpy record array from a list of (ordered) dicts with the same keys """
+    return rec.fromrecords([row.values() for row in rows], names=[str(key) for key in rows[0]])
+
+
 def do_nothing():
     pass